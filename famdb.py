@@ -42,22 +42,28 @@ DISCLAIMER:
 """
 
 import argparse
+import functools
 import json
 import logging
 import os
-import re
+import shlex
 import sys
 
 from famdb_globals import (
     LOGGER,
     FILE_DESCRIPTION,
+    FAMILY_FORMATS,
     FAMILY_FORMATS_EPILOG,
+    LOG_LEVELS,
     REPBASE_FILE,
     MISSING_FILE,
     HELP_URL,
+    buffer_spec_pat,
+    line_start_pat,
 )
-from famdb_helper_classes import Family
-from famdb_classes import FamDB
+
+# famdb_classes, famdb_helper_classes and numpy are imported where they are
+# used, so that --help and argument errors do not pay for loading h5py.
 
 
 # Command-line utilities
@@ -120,16 +126,30 @@ def command_names(args):
         raise ValueError("Unimplemented names format: %s" % args.format)
 
 
+def unlink_taxon(tax_id):
+    """Returns 'tax_id' with any "root_link:"/"leaf_link:" marker removed."""
+    if type(tax_id) == str and "_link:" in tax_id:
+        return tax_id.split(":")[1]
+    return tax_id
+
+
 def print_lineage_tree(
     file,
     tree,
     partition,
-    gutter_self,
-    gutter_children,
+    gutter,
+    branch,
     uncurated_only=False,
     curated_only=False,
 ):
-    """Pretty-prints a lineage tree with box drawing characters."""
+    """
+    Pretty-prints a lineage tree with box drawing characters.
+
+    'gutter' is a list of the segments drawn to the left of this node's
+    'branch' ("├─", "└─", or "" for the root). It is extended while the
+    children are printed and restored afterwards, so each line's prefix is
+    joined once instead of being rebuilt at every level of the recursion.
+    """
     if not tree:
         return
     if type(tree) == str:
@@ -139,49 +159,53 @@ def print_lineage_tree(
         tax_id = tree[0]
         children = tree[1:]
 
-    if "_link:" in str(tax_id):
-        tax_id = str(tax_id).split(":")[1]
+    tax_id = unlink_taxon(tax_id)
     name, tax_partition = file.get_taxon_name(tax_id, "scientific name")
     if name != "Not Found":
-        fams = file.get_families_for_taxon(
+        fam_count = file.count_families_for_taxon(
             tax_id,
             tax_partition,
             curated_only=curated_only,
             uncurated_only=uncurated_only,
         )
+        prefix = "".join(gutter)
         missing_message = MISSING_FILE % (tax_partition, file.db_dir, HELP_URL)
         missing_message = (
-            missing_message.replace("\t", f"{gutter_self[:-2]}│ * \t")
-            + f"\n{gutter_self[:-2]}│"
+            missing_message.replace("\t", f"{prefix}│ * \t") + f"\n{prefix}│"
         )
-        count = f"[{len(fams)}]" if fams is not None else missing_message
-        print(f"{gutter_self}{tax_id} {name}({tax_partition}) {count}")
+        count = f"[{fam_count}]" if fam_count is not None else missing_message
+        sys.stdout.write(f"{prefix}{branch}{tax_id} {name}({tax_partition}) {count}\n")
+
+    if not children:
+        return
+
+    # Below a non-last child, the line continues down to its next sibling
+    gutter.append("│ " if branch == "├─" else "  " if branch else "")
 
     # All but the last child need a downward-pointing line that will link up
     # to the next child, so this is split into two cases
-    if len(children) > 1:
-        for child in children[:-1]:
-            print_lineage_tree(
-                file,
-                child,
-                tax_partition,
-                gutter_children + "├─",
-                gutter_children + "│ ",
-                curated_only,
-                uncurated_only,
-            )
-
-    if children:
+    for child in children[:-1]:
         print_lineage_tree(
             file,
-            children[-1],
+            child,
             tax_partition,
-            gutter_children + "└─",
-            gutter_children + "  ",
+            gutter,
+            "├─",
             curated_only,
             uncurated_only,
         )
 
+    print_lineage_tree(
+        file,
+        children[-1],
+        tax_partition,
+        gutter,
+        "└─",
+        curated_only,
+        uncurated_only,
+    )
+    gutter.pop()
+
 
 def print_lineage_semicolons(
     file,
@@ -215,12 +239,12 @@ def print_lineage_semicolons(
             starting_at = None
 
         if not starting_at:
-            fams = file.get_families_for_taxon(
+            fam_count = file.count_families_for_taxon(
                 tax_id, tax_partition, curated_only, uncurated_only
             )
             count = (
-                f"[{len(fams)}]"
-                if fams is not None
+                f"[{fam_count}]"
+                if fam_count is not None
                 else f"(Taxon in Partition {tax_partition}, Partition File Not Found)"
             )
             print(f"{tax_id}({tax_partition}): {name} {count}")
@@ -237,6 +261,44 @@ def print_lineage_semicolons(
             )
 
 
+def flatten_tree(file, tree, target_id, partition):
+    """
+    Flattens the lineage 'tree' into parallel lists of node tax_ids and the
+    partition each node's families are read from, in depth-first order, along
+    with a list of flags marking the nodes at or below 'target_id'.
+    Also returns the set of partitions that were traversed into.
+
+    The top node is read from 'partition'. The children of a node are read
+    from that node's own partition, as found by find_taxon, and are skipped
+    if that partition is unknown.
+    """
+    node_ids = []
+    node_partitions = []
+    is_descendant = []
+    present = set()
+
+    stack = [(tree, partition, False)]
+    while stack:
+        node, partition, below_target = stack.pop()
+        tax_id = node[0]
+        children = node[1:]
+        below_target = below_target or target_id == tax_id
+
+        node_ids.append(tax_id)
+        node_partitions.append(partition)
+        is_descendant.append(below_target)
+
+        if not children:
+            continue
+        child_partition = file.find_taxon(tax_id)
+        if child_partition is not None:
+            present.add(child_partition)
+            for child in reversed(children):
+                stack.append((child, child_partition, below_target))
+
+    return node_ids, node_partitions, is_descendant, present
+
+
 def get_lineage_totals(
     file,
     tree,
@@ -244,62 +306,38 @@ def get_lineage_totals(
     partition,
     curated_only=False,
     uncurated_only=False,
-    seen=None,
-    present=None,
 ):
     """
-    Recursively calculates the total number of families
+    Calculates the total number of families
     on ancestors and descendants of 'target_id' in the given 'tree'.
 
-    'seen' is required to track families that are present on multiple
-    lineages due to horizontal transfer and ensure each family
-    is only counted one time, either as an ancestor or a descendant.
+    Families that are present on multiple lineages due to horizontal
+    transfer are only counted one time, either as an ancestor or a
+    descendant, at the first node they are found on in depth-first order.
     """
-    if not seen:
-        seen = set()
-    if not present:
-        present = set()
+    import numpy
 
-    tax_id = tree[0]
-    children = tree[1:]
-    accessions = file.get_families_for_taxon(
-        tax_id, partition, curated_only, uncurated_only
+    node_ids, node_partitions, is_descendant, present = flatten_tree(
+        file, tree, target_id, partition
+    )
+    families = file.get_families_for_taxa_bulk(
+        node_ids, node_partitions, curated_only, uncurated_only
     )
 
-    count_here = 0
-    for acc in accessions:
-        if acc not in seen:
-            seen.add(acc)
-            count_here += 1
+    lengths = [len(accessions) for accessions in families]
+    if not sum(lengths):
+        return [0, 0], present
 
-    if target_id == tax_id:
-        target_id = None
+    accessions = numpy.concatenate(
+        [numpy.array(accessions, dtype=str) for accessions in families if accessions]
+    )
+    side = numpy.repeat(numpy.array(is_descendant, dtype=bool), lengths)
 
-    counts = [0, 0]
-    for child in children:
-        partition = file.find_taxon(tax_id)
-        if partition is not None:
-            new_counts, new_present = get_lineage_totals(
-                file,
-                child,
-                target_id,
-                partition,
-                curated_only,
-                uncurated_only,
-                seen,
-                present,
-            )
-            counts[0] += new_counts[0]
-            counts[1] += new_counts[1]
-            present.add(partition)
-            present.update(new_present)
+    # index of the first occurrence of each accession, in depth-first order
+    _, first = numpy.unique(accessions, return_index=True)
+    descendant_count = int(numpy.count_nonzero(side[first]))
 
-    if target_id is None:
-        counts[1] += count_here
-    else:
-        counts[0] += count_here
-
-    return counts, present
+    return [len(first) - descendant_count, descendant_count], present
 
 
 def command_lineage(args):
@@ -326,7 +364,7 @@ def command_lineage(args):
     # TODO: prune branches with 0 total
     if args.format == "pretty":
         print_lineage_tree(
-            args.db_dir, tree, partition, "", "", args.curated, args.uncurated
+            args.db_dir, tree, partition, [], "", args.curated, args.uncurated
         )
     elif args.format == "semicolon":
         print_lineage_semicolons(
@@ -352,6 +390,21 @@ def command_lineage(args):
         raise ValueError("Unimplemented lineage format: %s" % args.format)
 
 
+@functools.lru_cache(maxsize=8)
+def format_copyright(copyright_text, file_format):
+    """
+    Returns 'copyright_text' as a header for 'file_format', with each line
+    commented out, or None if the format has no header.
+    """
+    if "hmm" in file_format:
+        return line_start_pat.sub("#   ", copyright_text)
+    elif "fasta" in file_format:
+        return None
+    elif "embl" in file_format:
+        return line_start_pat.sub("CC   ", copyright_text)
+    return copyright_text
+
+
 def print_families(args, families, header, species=None):
     """
     Prints each family in 'families', optionally with a copyright header. The
@@ -375,51 +428,46 @@ def print_families(args, families, header, species=None):
     if header:
         db_info = args.db_dir.get_db_info()
         if db_info:
-            copyright_text = db_info["copyright"]
-            # Add appropriate comment character to the copyright header lines
-            if "hmm" in args.format:
-                copyright_text = re.sub("(?m)^", "#   ", copyright_text)
-            elif "fasta" in args.format:
-                copyright_text = None
-            elif "embl" in args.format:
-                copyright_text = re.sub("(?m)^", "CC   ", copyright_text)
+            copyright_text = format_copyright(db_info["copyright"], args.format)
             if copyright_text:
                 print(copyright_text)
 
-    for family in families:
-        if args.format == "summary":
+    # Each format's entry writer is chosen once, rather than per family
+    if args.format == "summary":
+
+        def format_entry(family):
             if include_class_in_name:
                 name = family.name or family.accession
                 rm_class = family.repeat_type
                 if family.repeat_subtype:
                     rm_class += "/" + family.repeat_subtype
                 family.name = name + "#" + rm_class
-            entry = str(family) + "\n"
-        elif args.format == "hmm":
-            entry = family.to_dfam_hmm(
-                args.db_dir,
-                include_class_in_name=include_class_in_name,
-                require_general_threshold=require_general_threshold,
-            )
-        elif args.format == "hmm_species":
-            entry = family.to_dfam_hmm(
+            return str(family) + "\n"
+
+    elif args.format == "hmm" or args.format == "hmm_species":
+        hmm_species = species if args.format == "hmm_species" else None
+
+        def format_entry(family):
+            return family.to_dfam_hmm(
                 args.db_dir,
-                species,
+                hmm_species,
                 include_class_in_name=include_class_in_name,
                 require_general_threshold=require_general_threshold,
             )
-        elif (
-            args.format == "fasta"
-            or args.format == "fasta_name"
-            or args.format == "fasta_acc"
-        ):
-            use_accession = args.format == "fasta_acc"
 
+    elif (
+        args.format == "fasta"
+        or args.format == "fasta_name"
+        or args.format == "fasta_acc"
+    ):
+        use_accession = args.format == "fasta_acc"
+
+        def format_entry(family):
             buffers = []
             if stage and family.buffer_stages:
                 for spec in family.buffer_stages.split(","):
                     if "[" in spec:
-                        matches = re.match(r"(\d+)\[(\d+)-(\d+)\]", spec.strip())
+                        matches = buffer_spec_pat.match(spec.strip())
                         if matches:
                             if stage == int(matches.group(1)):
                                 buffers += [
@@ -459,17 +507,30 @@ def print_families(args, families, header, species=None):
                         )
                         or ""
                     )
-        elif args.format == "embl":
-            entry = family.to_embl(args.db_dir)
-        elif args.format == "embl_meta":
-            entry = family.to_embl(args.db_dir, include_meta=True, include_seq=False)
-        elif args.format == "embl_seq":
-            entry = family.to_embl(args.db_dir, include_meta=False, include_seq=True)
-        else:
-            raise ValueError("Unimplemented family format: %s" % args.format)
+            return entry
+
+    elif args.format == "embl":
+
+        def format_entry(family):
+            return family.to_embl(args.db_dir)
+
+    elif args.format == "embl_meta":
+
+        def format_entry(family):
+            return family.to_embl(args.db_dir, include_meta=True, include_seq=False)
+
+    elif args.format == "embl_seq":
+
+        def format_entry(family):
+            return family.to_embl(args.db_dir, include_meta=False, include_seq=True)
+
+    else:
+        raise ValueError("Unimplemented family format: %s" % args.format)
 
+    for family in families:
+        entry = format_entry(family)
         if entry:
-            print(entry, end="")
+            sys.stdout.write(entry)
 
 
 def command_family(args):
@@ -499,7 +560,8 @@ def command_families(args):
     # read the whole family data even though we read it again right after.
     # However it is *much* more memory-efficient than loading all the family
     # data at once and then sorting by accession.
-    accessions = sorted(
+    # get_families_by_accessions sorts the accessions, so they are not sorted here.
+    accessions = list(
         args.db_dir.get_accessions_filtered(
             tax_id=target_id,
             descendants=args.descendants,
@@ -512,7 +574,7 @@ def command_families(args):
             name=args.name,
         )
     )
-    families = map(args.db_dir.get_family_by_accession, accessions)
+    families = args.db_dir.get_families_by_accessions(accessions)
 
     header = True if accessions else False
     print_families(args, families, header, target_id)
@@ -537,6 +599,8 @@ def command_append(args):
     existing famdb file.
     """
 
+    from famdb_helper_classes import Family
+
     lookup = args.db_dir.get_all_taxa_names()
     repbase_lookup = {}
     with open(REPBASE_FILE) as file:
@@ -554,6 +618,9 @@ def command_append(args):
     total_ctr = 0
     added_ctr = 0
     dups = set()
+    # clade -> files with a taxonomy entry for it; most entries share clades
+    clade_files = {}
+
     for entry in embl_iter:
         total_ctr += 1
         acc = entry.accession
@@ -561,9 +628,13 @@ def command_append(args):
         # prepare set of local files to add family to
         add_files = set()
         for clade in entry.clades:
-            for file in args.db_dir.files:
-                if args.db_dir.files[file].has_taxon(clade):
-                    add_files.add(file)
+            if clade not in clade_files:
+                clade_files[clade] = [
+                    file
+                    for file in args.db_dir.files
+                    if args.db_dir.files[file].has_taxon(clade)
+                ]
+            add_files.update(clade_files[clade])
 
         if not add_files:
             LOGGER.debug(f" {acc} not added to local files, local file not found")
@@ -602,16 +673,100 @@ def command_append(args):
     args.db_dir.finalize()
 
 
+def command_serve(args):
+    """
+    The 'serve' command reads commands from standard input, one per line, and
+    runs each against the already opened database. Each line takes the same
+    form as the command-line arguments, e.g. "family -f hmm DF0000001". Batch
+    users avoid reopening the database, and rebuilding its caches, per query.
+    """
+    for line in sys.stdin:
+        serve_command(args, line)
+        # Each command's output is complete before the next line is read
+        sys.stdout.flush()
+
+
+def serve_command(args, line):
+    """Runs one command line read by the 'serve' command."""
+    words = shlex.split(line)
+    if not words:
+        return
+
+    # Only the command is parsed; global options such as -i and -l apply
+    # to the whole session and were fixed when it started.
+    if words[0].startswith("-"):
+        print(f"Double-Check Command: global option '{words[0]}' can not be served")
+        return
+    command = args.commands.get(words[0])
+    if command is None or words[0] in ("append", "serve"):
+        print(f"Double-Check Command: '{line.strip()}' can not be served")
+        return
+
+    try:
+        line_args = command.parse_args(words[1:])
+    except SystemExit:
+        # argparse has already printed the problem
+        return
+
+    line_args.db_dir = args.db_dir
+    if "term" in line_args:
+        line_args.term = " ".join(line_args.term)
+    try:
+        line_args.func(line_args)
+    except Exception as e:
+        LOGGER.debug("Command failed", exc_info=True)
+        print(f"Double-Check Command: {e}")
+
+
+def open_famdb(db_dir, mode):
+    """
+    Opens the FamDB in 'db_dir'. Only errors from opening the files are
+    handled here; anything else propagates with its original traceback.
+    """
+    from famdb_classes import FamDB
+
+    try:
+        return FamDB(db_dir, mode)
+    except OSError as e:
+        # HDF5 file locking fails on some network filesystems (e.g. NFS).
+        # famdb files do not have concurrent writers, so retry once with
+        # locking disabled, as the HDF5 documentation suggests.
+        if (
+            "lock" not in str(e).lower()
+            or os.environ.get("HDF5_USE_FILE_LOCKING") == "FALSE"
+        ):
+            raise
+        LOGGER.warning(f"Could not lock the database files, retrying without: {e}")
+        os.environ["HDF5_USE_FILE_LOCKING"] = "FALSE"
+        return FamDB(db_dir, mode)
+
+
 def main():  # ================================================================================================================================
     """Parses command-line arguments and runs the requested command."""
 
-    logging.basicConfig()
+    # Write output through one large buffer, instead of the default line
+    # buffering when stdout is a terminal. The caller flushes it on return.
+    sys.stdout = open(
+        sys.stdout.fileno(),
+        "w",
+        buffering=1 << 20,
+        encoding=sys.stdout.encoding,
+        errors=sys.stdout.errors,
+        closefd=False,
+    )
 
     parser = argparse.ArgumentParser(
         description=FILE_DESCRIPTION,
         formatter_class=argparse.RawDescriptionHelpFormatter,
     )
-    parser.add_argument("-l", "--log_level", default="INFO")
+    parser.add_argument(
+        "-l",
+        "--log_level",
+        default="info",
+        type=str.lower,
+        choices=LOG_LEVELS,
+        metavar="LOG_LEVEL",
+    )
 
     parser.add_argument("-i", "--db_dir", help="specifies the directory to query")
 
@@ -624,7 +779,7 @@ famdb.py families --help
         #  subcommands.  All subcommands will however be printed in the error message
         #  if a bad subcommand is entered as a possibility, so it doesn't hide it
         #  completely.  This is added to hide the new fasta_all command.
-        metavar="{info,names,lineage,families,family,append}",
+        metavar="{info,names,lineage,families,family,append,serve}",
     )
     # INFO --------------------------------------------------------------------------------------------------------------------------------
     p_info = subparsers.add_parser(
@@ -696,16 +851,6 @@ famdb.py families --help
     p_lineage.set_defaults(func=command_lineage)
 
     # FAMILIES --------------------------------------------------------------------------------------------------------------------------------
-    family_formats = [
-        "summary",
-        "hmm",
-        "hmm_species",
-        "fasta_name",
-        "fasta_acc",
-        "embl",
-        "embl_meta",
-        "embl_seq",
-    ]
     family_formats_epilog = FAMILY_FORMATS_EPILOG
 
     p_families = subparsers.add_parser(
@@ -757,7 +902,7 @@ with a given clade, optionally filtered by additional criteria",
         "-f",
         "--format",
         default="summary",
-        choices=family_formats,
+        choices=FAMILY_FORMATS,
         metavar="<format>",
         help="choose output format.",
     )
@@ -794,7 +939,7 @@ with a given clade, optionally filtered by additional criteria",
         "-f",
         "--format",
         default="summary",
-        choices=family_formats,
+        choices=FAMILY_FORMATS,
         metavar="<format>",
         help="choose output format.",
     )
@@ -813,19 +958,24 @@ with a given clade, optionally filtered by additional criteria",
         "--description",
         help="additional database description (added to the existing description)",
     )
-    p_append.set_defaults(func=command_append)
+    # the only command that writes to the database
+    p_append.set_defaults(func=command_append, mode="r+")
 
     # FASTA ALL --------------------------------------------------------------------------------------------------------------------------------
     p_fasta = subparsers.add_parser("fasta_all")
     p_fasta.set_defaults(func=command_fasta_all)
 
+    # SERVE --------------------------------------------------------------------------------------------------------------------------------
+    p_serve = subparsers.add_parser(
+        "serve",
+        description="Run commands read from standard input, one per line, opening the database only once.",
+    )
+    p_serve.set_defaults(func=command_serve, commands=subparsers.choices)
+
     args = parser.parse_args()
-    logging.getLogger().setLevel(getattr(logging, args.log_level.upper()))
+    logging.basicConfig(level=LOG_LEVELS[args.log_level])
 
-    if "func" in args and args.func is command_append:
-        mode = "r+"
-    else:
-        mode = "r"
+    mode = getattr(args, "mode", "r")
 
     if "term" in args:
         args.term = " ".join(args.term)
@@ -841,15 +991,12 @@ with a given clade, optionally filtered by additional criteria",
                 args.db_dir = default_db_dir
 
     if args.db_dir and os.path.isdir(args.db_dir):
-        try:
-            args.db_dir = FamDB(args.db_dir, mode)
-        except:
-            args.db_dir = None
-            # exc_value = sys.exc_info()[1]
-            # LOGGER.error("Error reading file: %s", exc_value)
-            # if LOGGER.getEffectiveLevel() <= logging.DEBUG:
-            #    raise
-            raise
+        if "func" not in args:
+            # No command was given, so there is no need to open the database
+            parser.print_help()
+            return
+
+        args.db_dir = open_famdb(args.db_dir, mode)
     else:
         # LOGGER.info(" No file directory specified, minimal initialization used")
         # args.db_dir = FamDB(args.db_dir, mode, min=True)
@@ -862,14 +1009,21 @@ with a given clade, optionally filtered by additional criteria",
         try:
             args.func(args)
         except Exception as e:
+            LOGGER.debug("Command failed", exc_info=True)
             print(f"Double-Check Command: {e}")
+            sys.exit(1)
     else:
         parser.print_help()
 
 
 if __name__ == "__main__":
     try:
-        main()
+        try:
+            main()
+        finally:
+            # Flush here rather than at interpreter exit, so that a closed
+            # pipe is handled below
+            sys.stdout.flush()
     except BrokenPipeError:
         # This workaround is from
         # https://docs.python.org/3/library/signal.html#note-on-sigpipe
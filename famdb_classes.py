@@ -1,4 +1,6 @@
+import bisect
 import datetime
+import functools
 import time
 import os
 import json
@@ -7,11 +9,13 @@ import sys
 import h5py
 import numpy
 
-from famdb_helper_classes import Family, Lineage
+from famdb_helper_classes import Family, Lineage, TaxaNames
 from famdb_globals import (
     LOGGER,
     FILE_VERSION,
     GENERATOR_VERSION,
+    METADATA_CACHE_MB,
+    NODE_CACHE_SIZE,
     LEAF_LINK,
     ROOT_LINK,
     GROUP_FAMILIES,
@@ -25,8 +29,10 @@ from famdb_globals import (
 )
 from famdb_helper_methods import (
     sanitize_name,
+    soundex,
     sounds_like,
     families_iterator,
+    family_entries_iterator,
     filter_curated,
     filter_repeat_type,
     filter_search_stages,
@@ -74,6 +80,19 @@ class FamDBLeaf:
 
         self.file = h5py.File(filename, mode)
         self.mode = mode
+        self.__groups = {}
+        self.__node = functools.lru_cache(maxsize=NODE_CACHE_SIZE)(self.__find_node)
+        self.__ancestors = {}
+
+        if mode != "r":
+            # Adding families writes many small objects (datasets, links and
+            # attributes). Start with a metadata cache large enough to hold
+            # them rather than letting HDF5 grow it from the 2MiB default.
+            config = self.file.id.get_mdc_config()
+            config.set_initial_size = True
+            config.initial_size = METADATA_CACHE_MB * 1024 * 1024
+            config.max_size = max(config.max_size, config.initial_size)
+            self.file.id.set_mdc_config(config)
 
         try:
             if reading and self.file.attrs["version"] != FILE_VERSION:
@@ -222,6 +241,26 @@ class FamDBLeaf:
 
         return True
 
+    def __require_group(self, path):
+        """
+        Returns the group at 'path', creating it if needed. Lookup groups are
+        shared by every family written, so their handles are kept open.
+        """
+        group = self.__groups.get(path)
+        if group is None:
+            group = self.__groups[path] = self.file.require_group(path)
+        return group
+
+    def __group(self, path):
+        """
+        Returns the existing group at 'path'. The top-level groups are looked up
+        for every taxon or family accessed, so their handles are kept open.
+        """
+        group = self.__groups.get(path)
+        if group is None:
+            group = self.__groups[path] = self.file[path]
+        return group
+
     def add_family(self, family):
         """Adds the family described by 'family' to the database."""
         # Verify uniqueness of name and accession.
@@ -245,32 +284,35 @@ class FamDBLeaf:
         )
 
         # Set the family attributes
+        attrs = dset.attrs
         for k in Family.META_LOOKUP:
             value = getattr(family, k)
             if value:
-                dset.attrs[k] = value
+                attrs[k] = value
 
         # Create links
         fam_link = f"/{group_path}/{family.accession}"
         if family.name:
-            self.file.require_group(GROUP_LOOKUP_BYNAME)[str(family.name)] = (
-                h5py.SoftLink(fam_link)
+            self.__require_group(GROUP_LOOKUP_BYNAME)[str(family.name)] = h5py.SoftLink(
+                fam_link
             )
         # In FamDB format version 0.5 we removed the /Families/ByAccession group as it's redundant
         # (all the data is in Families/<datasets> *and* HDF5 suffers from poor performance when
         # the number of entries in a group exceeds 200-500k.
 
+        nodes = self.__require_group(GROUP_NODES)
         for clade_id in family.clades:
             clade = str(clade_id)
-            nodes = self.file[GROUP_NODES]
             if clade in nodes:
                 families_group = nodes[clade].require_group("Families")
                 families_group[family.accession] = h5py.SoftLink(fam_link)
 
         def add_stage_link(stage, accession):
-            stage_group = self.file.require_group(GROUP_LOOKUP_BYSTAGE).require_group(
-                stage.strip()
-            )
+            stage = stage.strip()
+            if not stage:
+                # e.g. a trailing comma; "ByStage/" would be ByStage itself
+                return
+            stage_group = self.__require_group(f"{GROUP_LOOKUP_BYSTAGE}/{stage}")
             if accession not in stage_group:
                 stage_group[accession] = h5py.SoftLink(fam_link)
 
@@ -305,21 +347,56 @@ class FamDBLeaf:
             for child in tax_db[node].children:
                 child_ids += [int(child.tax_id)]
             group.create_dataset("Children", data=numpy.array(child_ids))
+        self.__node.cache_clear()
+        self.__ancestors.clear()
         delta = time.perf_counter() - start
         LOGGER.info("Wrote %d taxonomy nodes in %f", count, delta)
 
     # Data Access Methods ------------------------------------------------------------------------------------------------
+    def __find_node(self, tax_id):
+        """
+        Returns the taxonomy group for 'tax_id' (as a string), or None if this
+        file has no entry for it. Called through the self.__node cache, since
+        the same nodes are looked up repeatedly while walking a lineage.
+        """
+        return self.__group(GROUP_NODES).get(tax_id)
+
+    def __ancestors_of(self, tax_id):
+        """
+        Returns the ancestors of 'tax_id' in this file as a tuple, nearest first.
+        If the lineage continues in another file, the tuple ends with a ROOT_LINK
+        indicator in place of the last ancestor. Each chain is walked only once.
+        """
+        key = str(tax_id)
+        chain = self.__ancestors.get(key)
+        if chain is None:
+            chain = []
+            while tax_id:
+                node = self.__node(str(tax_id))
+                if "Parent" in node:
+                    # test if parent is in this file
+                    if self.__node(str(node["Parent"][0])) is not None:
+                        tax_id = node["Parent"][0]
+                        # h5py is based on numpy, need to cast numpy base64 to python int for serialization in Lineage class
+                        chain.append(int(tax_id))
+                    else:
+                        chain.append(f"{ROOT_LINK}{tax_id}")
+                        tax_id = None
+                else:
+                    tax_id = None
+            chain = self.__ancestors[key] = tuple(chain)
+        return chain
+
     def has_taxon(self, tax_id):
         """Returns True if 'self' has a taxonomy entry for 'tax_id'"""
-        return str(tax_id) in self.file[GROUP_NODES]
+        return self.__node(str(tax_id)) is not None
 
     def get_families_for_taxon(self, tax_id, curated_only=False, uncurated_only=False):
         """Returns a list of the accessions for each family directly associated with 'tax_id'."""
-        group = (
-            self.file[GROUP_NODES][str(tax_id)].get("Families")
-            if f"{GROUP_NODES}/{tax_id}/Families" in self.file
-            else {}
-        )
+        node = self.__node(str(tax_id))
+        group = node.get("Families") if node is not None else None
+        if group is None:
+            group = {}
 
         # Filter out DF/DR or not at all depending on flags
         if curated_only:
@@ -347,52 +424,58 @@ class FamDBLeaf:
         lineage.
         """
 
-        group_nodes = self.file[GROUP_NODES]
+        node_of = self.__node
         ancestors = True if kwargs.get("ancestors") else False
         descendants = True if kwargs.get("descendants") else False
         root = self.is_root()
         if descendants:
-
-            def descendants_of(tax_id):
-                descendants = [
-                    int(tax_id)
-                ]  # h5py is based on numpy, need to cast numpy base64 to python int for serialization in Lineage class
-                for child in group_nodes[str(tax_id)]["Children"]:
+            # Walk the subtree with an explicit stack, filling in each node's list
+            # of children after it has been attached to its parent's list
+            for_combine = kwargs.get("for_combine")
+            # h5py is based on numpy, need to cast numpy base64 to python int for serialization in Lineage class
+            tree = [int(tax_id)]
+            stack = [tree]
+            while stack:
+                subtree = stack.pop()
+                for child in node_of(str(subtree[0]))["Children"]:
                     # only list the decendants of the target node if it's not being combined with another decendant lineage
-                    if not kwargs.get("for_combine") and str(child) in group_nodes:
-                        descendants += [descendants_of(child)]
+                    if not for_combine and node_of(str(child)) is not None:
+                        child_tree = [int(child)]
+                        subtree.append(child_tree)
+                        stack.append(child_tree)
                     elif root:
-                        descendants += [f"{LEAF_LINK}{child}"]
-                return descendants
-
-            tree = descendants_of(tax_id)
+                        subtree.append(f"{LEAF_LINK}{child}")
         else:
             tree = [tax_id]
 
         if ancestors:
-            while tax_id:
-                node = group_nodes[str(tax_id)]
-                if "Parent" in node:
-                    # test if parent is in this file
-                    if str(node["Parent"][0]) in group_nodes:
-                        tax_id = node["Parent"][0]
-                        tree = [
-                            int(tax_id),
-                            tree,
-                        ]  # h5py is based on numpy, need to cast numpy base64 to python int for serialization in Lineage class
-                    else:
-                        tree = [f"{ROOT_LINK}{tax_id}", tree]
-                        tax_id = None
-                else:
-                    tax_id = None
+            for ancestor in self.__ancestors_of(tax_id):
+                tree = [ancestor, tree]
 
         lineage = Lineage(tree, root, self.get_partition_num())
         return lineage
 
+    def count_families_for_taxon(
+        self, tax_id, curated_only=False, uncurated_only=False
+    ):
+        """
+        Returns the number of families directly associated with 'tax_id'.
+        Without a curation filter this is the size of the node's Families
+        group, so the accessions themselves are not read.
+        """
+        if curated_only or uncurated_only:
+            return len(
+                self.get_families_for_taxon(tax_id, curated_only, uncurated_only)
+            )
+        node = self.__node(str(tax_id))
+        group = node.get("Families") if node is not None else None
+        return len(group) if group is not None else 0
+
     def filter_stages(self, accession, stages):
         """Returns True if the family belongs to a search or buffer stage in 'stages'."""
+        by_stage = self.__group(GROUP_LOOKUP_BYSTAGE)
         for stage in stages:
-            grp = self.file[GROUP_LOOKUP_BYSTAGE].get(stage)
+            grp = by_stage.get(stage)
             if grp and accession in grp:
                 return True
 
@@ -401,7 +484,7 @@ class FamDBLeaf:
     # Family Getters --------------------------------------------------------------------------
     def get_family_names(self):  # TODO unused
         """Returns a list of names of families in the database."""
-        return sorted(self.file[GROUP_LOOKUP_BYNAME].keys(), key=str.lower)
+        return sorted(self.__group(GROUP_LOOKUP_BYNAME).keys(), key=str.lower)
 
     def get_family_by_accession(self, accession):
         """Returns the family with the given accession."""
@@ -416,7 +499,9 @@ class FamDBLeaf:
         # TODO: This will also suffer the performance issues seen with
         #       other groups that exceed 200-500k entries in a single group
         #       at some point.  This needs to be refactored to scale appropriately.
-        entry = self.file[GROUP_LOOKUP_BYNAME].get(name)
+        if GROUP_LOOKUP_BYNAME not in self.file:
+            return None
+        entry = self.__group(GROUP_LOOKUP_BYNAME).get(name)
         return get_family(entry)
 
 
@@ -443,13 +528,17 @@ class FamDBRoot(FamDBLeaf):
 
         if mode == "r" or mode == "r+":
             self.names_dump = {
-                partition: json.loads(
+                partition: TaxaNames(
                     self.file[f"{GROUP_TAXANAMES}/{partition}"]["TaxaNames"][0]
                 )
                 for partition in self.file[GROUP_TAXANAMES]
             }
             self.file_info = self.get_file_info()
             self.__lineage_cache = {}
+            self.__search_names = {}
+            self.__sound_index = {}
+            self.__taxon_names = {}
+            self.__sanitized_names = {}
 
     def write_taxa_names(self, tax_db, nodes):
         """
@@ -483,8 +572,16 @@ class FamDBRoot(FamDBLeaf):
         Checks names_dump for each partition and returns eturns the first name of the given 'kind'
         for the taxon given by 'tax_id', or None if no such name was found.
         """
+        key = (str(tax_id), kind)
+        found = self.__taxon_names.get(key)
+        if found is None:
+            found = self.__taxon_names[key] = self.__find_taxon_name(key[0], kind)
+        return found
+
+    def __find_taxon_name(self, tax_id, kind):
+        """Looks up the name for get_taxon_name, which caches the result."""
         for partition in self.names_dump:
-            names = self.names_dump[partition].get(str(tax_id))
+            names = self.names_dump[partition].get(tax_id)
             if names is not None:
                 for name in names:
                     if name[0] == kind:
@@ -506,29 +603,101 @@ class FamDBRoot(FamDBLeaf):
         """
 
         text = text.lower()
+        text_prefix = text + " <"
         for partition in self.names_dump:
-            for tax_id, names in self.names_dump[partition].items():
+            nodes, names_text, offsets, by_sanitized = self.__get_search_names(
+                partition
+            )
+            if text and "\0" not in text:
+                # Only nodes with a name containing 'text' or sanitizing to it
+                # (or sounding like it) can match; find those in the joined text
+                # and the indexes, and check just them.
+                candidates = set(by_sanitized.get(text, ()))
+                if search_similar:
+                    sound_index = self.__get_sound_index(partition)
+                    candidates.update(sound_index.get(soundex(text), ()))
+                pos = names_text.find(text)
+                while pos >= 0:
+                    node = bisect.bisect_right(offsets, pos) - 1
+                    candidates.add(node)
+                    if node + 1 == len(offsets):
+                        break
+                    pos = names_text.find(text, offsets[node + 1])
+                candidates = [nodes[node] for node in sorted(candidates)]
+            else:
+                candidates = nodes
+
+            for tax_id, names in candidates:
                 matches = False
                 exact = False
-                for name_cls, name_txt in names:
-                    name_txt = name_txt.lower()
+                for name_cls, name_txt, sanitized_txt in names:
                     if kind is None or kind == name_cls:
-                        if text == name_txt:
-                            matches = True
-                            exact = True
-                        elif name_txt.startswith(text + " <"):
-                            matches = True
-                            exact = True
-                        elif text == sanitize_name(name_txt):
+                        if (
+                            text == name_txt
+                            or name_txt.startswith(text_prefix)
+                            or text == sanitized_txt
+                        ):
                             matches = True
                             exact = True
-                        elif text in name_txt:
+                            break
+                        if text in name_txt:
                             matches = True
                         elif search_similar and sounds_like(text, name_txt):
                             matches = True
 
                 if matches:
-                    yield [int(tax_id), exact, int(partition)]
+                    yield [tax_id, exact, int(partition)]
+
+    def __get_search_names(self, partition):
+        """
+        Returns the search index for 'partition', built on its first search:
+        * a list of (tax_id, names) pairs, where names is a list of
+          (name_class, lowercase name, sanitized name)
+        * the lowercase names of every node joined by NUL characters
+        * the offset of each node's first name in that text
+        * the indices of the nodes having each sanitized name
+        """
+        index = self.__search_names.get(partition)
+        if index is None:
+            nodes = []
+            offsets = []
+            by_sanitized = {}
+            position = 0
+            for tax_id, names in self.names_dump[partition].items():
+                lowered = []
+                for name_cls, name_txt in names:
+                    name_txt = name_txt.lower()
+                    sanitized_txt = sanitize_name(name_txt)
+                    # a handful of distinct classes, repeated for every name
+                    name_cls = sys.intern(name_cls)
+                    lowered.append((name_cls, name_txt, sanitized_txt))
+                    by_sanitized.setdefault(sanitized_txt, []).append(len(nodes))
+                offsets.append(position)
+                position += sum(len(name[1]) + 1 for name in lowered) or 1
+                nodes.append((int(tax_id), lowered))
+            names_text = "\0".join(
+                "\0".join(name[1] for name in names) for _, names in nodes
+            )
+            index = (nodes, names_text, offsets, by_sanitized)
+            self.__search_names[partition] = index
+        return index
+
+    def __get_sound_index(self, partition):
+        """
+        Returns a dict of each soundex code in 'partition' to the indices of the
+        nodes having a name with that code. Built on the first "sounds like"
+        search of each partition.
+        """
+        sound_index = self.__sound_index.get(partition)
+        if sound_index is None:
+            sound_index = {}
+            nodes = self.__get_search_names(partition)[0]
+            for node, (_, names) in enumerate(nodes):
+                for _, name_txt, _ in names:
+                    if name_txt:
+                        sound_index.setdefault(soundex(name_txt), set()).add(node)
+            self.__sound_index[partition] = sound_index
+        return sound_index
 
     def resolve_species(self, term, kind=None, search_similar=False):
         """
@@ -562,16 +731,13 @@ class FamDBRoot(FamDBLeaf):
         for tax_id, is_exact, partition in self.search_taxon_names(
             term, kind, search_similar
         ):
-            hit = [tax_id, partition]
             if is_exact:
-                exact += [hit]
+                exact.append([tax_id, partition, True])
             else:
-                inexact += [hit]
+                inexact.append([tax_id, partition, False])
 
         # Combine back into one list, with exact matches first
-        results = [[*hit, True] for hit in exact]
-        for hit in inexact:
-            results += [[*hit, False]]
+        results = exact + inexact
 
         if len(results) == 0 and not search_similar:
             # Try a sounds-like search (currently soundex)
@@ -628,9 +794,14 @@ up with the 'names' command.""",
         of the scientific name.
         """
 
+        key = str(tax_id)
+        if key in self.__sanitized_names:
+            return self.__sanitized_names[key]
+
         name = self.get_taxon_name(tax_id, "scientific name")
         if name:
             name = sanitize_name(name[0])
+        self.__sanitized_names[key] = name
         return name
 
     def get_lineage_path(self, tax_id, tree=[], cache=True, partition=True):
@@ -686,18 +857,22 @@ up with the 'names' command.""",
         return None
 
     def get_all_taxa_names(self):
-        taxa = set()
+        kinds = ("sanitized scientific name", "sanitized synonym")
+
+        # One pass over the names, keeping the first name of each kind per
+        # taxon as get_taxon_name would. These are not put in its cache.
+        taxa = {}
         for partition in self.names_dump:
-            for key in self.names_dump[partition].keys():
-                taxa.add(key)
+            for taxon, names in self.names_dump[partition].items():
+                taxon_names = taxa.setdefault(taxon, {})
+                for name_cls, name_txt in names:
+                    if name_cls in kinds:
+                        taxon_names.setdefault(name_cls, name_txt)
+
         sanitized_dict = {}
-        for taxon in taxa:
-            sanitized_dict[
-                self.get_taxon_name(taxon, kind="sanitized scientific name")[0].lower()
-            ] = taxon
-            sanitized_dict[
-                self.get_taxon_name(taxon, kind="sanitized synonym")[0].lower()
-            ] = taxon
+        for taxon, taxon_names in taxa.items():
+            for kind in kinds:
+                sanitized_dict[taxon_names.get(kind, "Not Found").lower()] = taxon
         return sanitized_dict
 
 
@@ -785,6 +960,11 @@ class FamDB:
         self.db_version = file_info["meta"]["db_version"]
         self.db_date = file_info["meta"]["db_date"]
 
+        # Attribute reads that are repeated within one invocation
+        self.__db_info = None
+        self.__metadata = None
+        self.__counts = None
+
         err_files = []
         for file in self.files:
             meta = self.files[file].get_file_info()["meta"]
@@ -881,7 +1061,10 @@ class FamDB:
             print()
 
     def assemble_filters(self, **kwargs):
-        """Define family filters (logically ANDed together)"""
+        """
+        Define family filters (logically ANDed together). The stage filter is
+        also returned on its own, or None if there is none.
+        """
         filters = []
         if kwargs.get("curated_only"):
             filters += [lambda a, f: filter_curated(a, True)]
@@ -897,10 +1080,13 @@ class FamDB:
             elif filter_stage == 95:
                 # "stage 95" = this specific stage list:
                 stages = ["35", "50", "55", "60", "65", "70", "75"]
-                filters += [lambda a, f: self.filter_stages(a, stages)]
             else:
                 stages = [str(filter_stage)]
-                filters += [lambda a, f: self.filter_stages(a, stages)]
+
+        stage_filter = None
+        if stages:
+            stage_filter = lambda a, f: self.filter_stages(a, stages)
+            filters += [stage_filter]
 
         # HMM only: add a search stage filter to "un-list" families that were
         # allowed through only because they match in buffer stage
@@ -917,7 +1103,7 @@ class FamDB:
             name = name.lower()
             filters += [lambda a, f: filter_name(f(), name)]
 
-        return filters, stages, repeat_type, name
+        return filters, stages, repeat_type, name, stage_filter
 
     def get_accessions_filtered(self, **kwargs):
         """
@@ -952,36 +1138,47 @@ class FamDB:
             ancestors = kwargs.get("ancestors") or False
             descendants = kwargs.get("descendants") or False
 
-        filters, stages, repeat_type, name_filter = self.assemble_filters(**kwargs)
+        filters, stages, repeat_type, name_filter, stage_filter = self.assemble_filters(
+            **kwargs
+        )
+
+        # special case: Searching the whole database in a specific
+        # stage only is a common usage pattern in RepeatMasker.
+        # When searching the whole database instead of a species,
+        # the number of accessions to read through is shorter
+        # when going off of only the stage indexes.
+        stage_indexed = (
+            tax_id == 1
+            and descendants
+            and stages
+            and not repeat_type
+            and not name_filter
+        )
+        if stage_indexed:
+            # every accession in the stage indexes passes the stage filter
+            filters = [filt for filt in filters if filt is not stage_filter]
 
-        # Recursive iterator flattener
+        # Iterative flattener, in the same order as a recursive walk
         def walk_tree(tree):
             """Returns all elements in 'tree' with all levels flattened."""
-            if hasattr(tree, "__iter__"):
-                for elem in tree:
-                    yield from walk_tree(elem)
-            else:
-                yield tree
+            stack = [tree]
+            while stack:
+                elem = stack.pop()
+                if hasattr(elem, "__iter__") and not isinstance(elem, str):
+                    stack.extend(reversed(elem))
+                else:
+                    yield elem
 
         seen = set()
 
         def iterate_accs():
-            # special case: Searching the whole database in a specific
-            # stage only is a common usage pattern in RepeatMasker.
-            # When searching the whole database instead of a species,
-            # the number of accessions to read through is shorter
-            # when going off of only the stage indexes.
             files = self.files
-            if (
-                tax_id == 1
-                and descendants
-                and stages
-                and not repeat_type
-                and not name_filter
-            ):
+            if stage_indexed:
+                stage_groups = [
+                    files[file].file.get(GROUP_LOOKUP_BYSTAGE) for file in files
+                ]
                 for stage in stages:
-                    for file in files:
-                        by_stage = files[file].file.get(GROUP_LOOKUP_BYSTAGE)
+                    for by_stage in stage_groups:
                         if by_stage:
                             grp = by_stage.get(stage)
                             if grp:
@@ -992,9 +1189,7 @@ class FamDB:
             elif tax_id == 1 and descendants:
                 # yield from self.file[FamDBLeaf.GROUP_LOOKUP_BYACC].keys() # TODO unused
                 for file in files:
-                    names = families_iterator(
-                        files[file].file[GROUP_FAMILIES], "Families"
-                    )
+                    names = families_iterator(files[file].file[GROUP_FAMILIES])
                     for name in names:
                         yield name
             else:
@@ -1007,29 +1202,33 @@ class FamDB:
                     if fams:
                         yield from fams
 
+        h5_files = [self.files[file].file for file in self.files]
         for accession in iterate_accs():
             if accession in seen:
                 continue
             seen.add(accession)
 
-            cached_family = None
+            cached_attrs = None
 
             def family_getter():
-                nonlocal cached_family
-                if not cached_family:
+                """
+                Returns the attributes of the family, looked up on first use.
+                Filters read only the attributes they need from it, each once.
+                """
+                nonlocal cached_attrs
+                if cached_attrs is None:
                     path = accession_bin(accession)
-                    for file in self.files:
-                        if self.files[file].file.get(path):
-                            fam = self.files[file].file[path].get(accession)
+                    for h5_file in h5_files:
+                        group = h5_file.get(path)
+                        if group:
+                            fam = group.get(accession)
                             if fam:
-                                cached_family = fam
-                return cached_family
-
-            match = True
-            for filt in filters:
-                if not filt(accession, family_getter):
-                    match = False
-            if match:
+                                cached_attrs = fam.attrs
+                                break
+                return cached_attrs
+
+            # filters are ordered cheapest first, so stop at the first miss
+            if all(filt(accession, family_getter) for filt in filters):
                 yield accession
 
     def resolve_names(self, term):
@@ -1040,25 +1239,32 @@ class FamDB:
         return entries
 
     def fasta_all(self, group):
+        """
+        Returns an iterator over every family stored under GROUP_FAMILIES + 'group',
+        yielding each accession once. Families are read from the datasets as
+        they are iterated, rather than looked up again by accession.
+        """
         seen = set()
         for file in self.files:
             if GROUP_FAMILIES + group in self.files[file].file:
-                for name in families_iterator(
-                    self.files[file].file[GROUP_FAMILIES + group], "Families" + group
+                for name, entry in family_entries_iterator(
+                    self.files[file].file[GROUP_FAMILIES + group]
                 ):
                     if name not in seen:
                         seen.add(name)
-                        yield self.get_family_by_accession(name)
+                        yield get_family(entry)
 
     # Wrapper methods ---------------------------------------------------------------------------------------
     def get_counts(self):
-        counts = {"consensus": 0, "hmm": 0, "file": 0}
-        for file in self.files:
-            file_counts = self.files[file].get_counts()
-            counts["consensus"] += file_counts["consensus"]
-            counts["hmm"] += file_counts["hmm"]
-            counts["file"] += 1
-        return counts
+        if self.__counts is None:
+            counts = {"consensus": 0, "hmm": 0, "file": 0}
+            for file in self.files:
+                file_counts = self.files[file].get_counts()
+                counts["consensus"] += file_counts["consensus"]
+                counts["hmm"] += file_counts["hmm"]
+                counts["file"] += 1
+            self.__counts = counts
+        return dict(self.__counts)
 
     def get_lineage_path(self, tax_id, **kwargs):
         """method used in EMBL exports"""
@@ -1076,13 +1282,18 @@ class FamDB:
         return self.files[0].get_sanitized_name(tax_id)
 
     def get_db_info(self):
-        return self.files[0].get_db_info()
+        if self.__db_info is None:
+            self.__db_info = self.files[0].get_db_info()
+        # callers such as command_append edit the returned dict
+        return dict(self.__db_info) if self.__db_info else self.__db_info
 
     def resolve_one_species(self, term):
         return self.files[0].resolve_one_species(term)
 
     def get_metadata(self):
-        return self.files[0].get_metadata()
+        if self.__metadata is None:
+            self.__metadata = self.files[0].get_metadata()
+        return dict(self.__metadata)
 
     def get_taxon_name(self, tax_id, kind):
         return self.files[0].get_taxon_name(tax_id, kind)
@@ -1097,6 +1308,30 @@ class FamDB:
         else:
             return None
 
+    def count_families_for_taxon(
+        self, tax_id, partition, curated_only=False, uncurated_only=False
+    ):
+        """As get_families_for_taxon, but returns only the number of families."""
+        if partition in self.files:
+            return self.files[partition].count_families_for_taxon(
+                tax_id, curated_only, uncurated_only
+            )
+        else:
+            return None
+
+    def get_families_for_taxa_bulk(
+        self, tax_ids, partitions, curated_only=False, uncurated_only=False
+    ):
+        """
+        Returns a list of the accessions directly associated with each of 'tax_ids',
+        each read from the corresponding entry of 'partitions'.
+        """
+        return [
+            self.get_families_for_taxon(tax_id, partition, curated_only, uncurated_only)
+            or []
+            for tax_id, partition in zip(tax_ids, partitions)
+        ]
+
     def get_family_by_accession(self, accession):
         for file in self.files:
             fam = self.files[file].get_family_by_accession(accession)
@@ -1104,6 +1339,35 @@ class FamDB:
                 return fam
         return None
 
+    def get_families_by_accessions(self, accessions):
+        """
+        Returns an iterator over the families with the given 'accessions', in
+        sorted order. Sorting keeps accessions sharing an HDF5 bin adjacent, so
+        each bin group is looked up only once per partition file rather than
+        once per accession.
+
+        Neighboring accessions usually come from the same partition, so the
+        partition that last had a match is searched first.
+        """
+        bin_path = None
+        bin_groups = []
+        for accession in sorted(accessions):
+            path = accession_bin(accession)
+            if path != bin_path:
+                bin_path = path
+                bin_groups = [
+                    self.files[file].file.get(path)
+                    for file in self.files
+                    if path in self.files[file].file
+                ]
+            for idx, group in enumerate(bin_groups):
+                entry = group.get(accession)
+                if entry:
+                    if idx:
+                        bin_groups.insert(0, bin_groups.pop(idx))
+                    yield get_family(entry)
+                    break
+
     def get_family_by_name(self, accession):
         for file in self.files:
             fam = self.files[file].get_family_by_name(accession)
@@ -1117,15 +1381,20 @@ class FamDB:
     def finalize(self):
         for file in self.files:
             self.files[file].finalize()
+        self.__counts = None
 
     def set_db_info(self, name, version, date, desc, copyright_text):
         for file in self.files:
             self.files[file].set_db_info(name, version, date, desc, copyright_text)
+        self.__db_info = None
 
     def filter_stages(self, accession, stages):
+        # Only the location of the family is needed, so check for its dataset
+        # rather than reading it into a Family
+        path = accession_bin(accession)
         for file in self.files:
-            fam = self.files[file].get_family_by_accession(accession)
-            if fam:
+            group = self.files[file].file.get(path)
+            if group is not None and accession in group:
                 return self.files[file].filter_stages(accession, stages)
 
     def get_all_taxa_names(self):
@@ -3,6 +3,17 @@ import re
 
 LOGGER = logging.getLogger(__name__)
 
+LOG_LEVELS = {
+    "notset": logging.NOTSET,
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warn": logging.WARN,
+    "warning": logging.WARNING,
+    "error": logging.ERROR,
+    "fatal": logging.FATAL,
+    "critical": logging.CRITICAL,
+}
+
 GROUP_FAMILIES = "Families"
 GROUP_LOOKUP_BYNAME = "Lookup/ByName"
 GROUP_LOOKUP_BYACC = "Lookup/ByAccession"
@@ -13,12 +24,46 @@ GROUP_TAXANAMES = "Partitions"
 # DF####### or DF########## or DR####### or DR##########
 dfam_acc_pat = re.compile("^(D[FR])([0-9]{2})([0-9]{2})([0-9]{2})[0-9]{3,6}$")
 
+# STAGE[START-END], as used in BufferStages
+buffer_spec_pat = re.compile(r"(\d+)\[(\d+)-(\d+)\]")
+
+# The start of every line, for prefixing comment characters
+line_start_pat = re.compile("(?m)^")
+
+# Taxon name sanitization; must be kept in sync with Dfam's algorithm
+sanitize_space_pat = re.compile(r"[\s\,\_]+")
+sanitize_drop_pat = re.compile(r"[\(\)\<\>\']+")
+
+# EMBL fields read by Family.read_embl_families
+embl_id_pat = re.compile(r"(\S*)")
+embl_type_pat = re.compile(r"\s*Type:\s*(\S+)")
+embl_subtype_pat = re.compile(r"\s*SubType:\s*(\S+)")
+embl_species_pat = re.compile(r"Species:\s*(.+)")
+embl_search_stages_pat = re.compile(r"SearchStages:\s*(\S+)")
+embl_buffer_stages_pat = re.compile(r"BufferStages:\s*(\S+)")
+
+# Every byte that is not an ASCII letter, for bytes.translate(None, ...)
+NON_ALPHA_BYTES = bytes(byte for byte in range(256) if not bytes([byte]).isalpha())
+
+# The CKSUM line that ends the header of an HMM
+hmm_cksum_pat = re.compile(r"(?m)^CKSUM.*")
+
 # The current version of the file format
 FILE_VERSION = "1.0"
 
 # The version of the famdb python package
 GENERATOR_VERSION = "1.0.2"
 
+# Number of distinct taxa looked up in a partition's TaxaNames JSON text
+# before the whole table is parsed instead
+TAXA_NAMES_SCAN_LIMIT = 16
+
+# Number of taxonomy node group handles kept open per file
+NODE_CACHE_SIZE = 4096
+
+# Initial HDF5 metadata cache size for files opened for writing
+METADATA_CACHE_MB = 64
+
 LEAF_LINK = "leaf_link:"
 ROOT_LINK = "root_link:"
 
@@ -89,6 +134,17 @@ example commands, including the most commonly used options:
 
 """
 
+FAMILY_FORMATS = (
+    "summary",
+    "hmm",
+    "hmm_species",
+    "fasta_name",
+    "fasta_acc",
+    "embl",
+    "embl_meta",
+    "embl_seq",
+)
+
 FAMILY_FORMATS_EPILOG = """
 Supported formats:
   * 'summary'     : (default) A human-readable summary format. Currently includes
@@ -149,3 +205,14 @@ SOUNDEX_LOOKUP = {
     "H": None,
     "W": None,
 }
+
+# SOUNDEX_LOOKUP as a str.translate table, with "h" standing in for H and W
+SOUNDEX_TABLE = str.maketrans(
+    {ch: "h" if code is None else str(code) for ch, code in SOUNDEX_LOOKUP.items()}
+)
+
+# Characters ignored by soundex
+soundex_skip_pat = re.compile("[^A-Z]+")
+
+# Runs of a repeated character
+repeat_pat = re.compile(r"(.)\1+")
@@ -2,11 +2,23 @@
 import collections
 import textwrap
 import json
-import re
 import sys
 
 
-from famdb_globals import LOGGER, LEAF_LINK, ROOT_LINK
+from famdb_globals import (
+    LOGGER,
+    LEAF_LINK,
+    ROOT_LINK,
+    NON_ALPHA_BYTES,
+    TAXA_NAMES_SCAN_LIMIT,
+    embl_buffer_stages_pat,
+    embl_id_pat,
+    embl_search_stages_pat,
+    embl_species_pat,
+    embl_subtype_pat,
+    embl_type_pat,
+    hmm_cksum_pat,
+)
 
 
 class Lineage(list):  # TODO replace exits  with real exception
@@ -73,6 +85,67 @@ class Lineage(list):  # TODO replace exits  with real exception
         return self.lineage
 
 
+class TaxaNames:
+    """
+    The names of the taxa in one partition, read from its TaxaNames JSON text.
+    Supports the dict methods used on names_dump, keyed by str(tax_id).
+
+    Parsing the whole table costs seconds for a full Dfam root partition, and
+    most commands only need a few taxa. A lookup finds the tax_id's key in the
+    JSON text and decodes just that entry. The table is parsed in full when it
+    is iterated, or after TAXA_NAMES_SCAN_LIMIT distinct lookups, since each
+    lookup has to scan the text.
+    """
+
+    __decoder = json.JSONDecoder()
+
+    def __init__(self, text):
+        if isinstance(text, bytes):
+            text = text.decode()
+        self.__text = text
+        self.__names = None
+        self.__found = {}
+
+    def __parse(self):
+        if self.__names is None:
+            self.__names = json.loads(self.__text)
+            self.__text = None
+            self.__found = None
+        return self.__names
+
+    def __lookup(self, tax_id):
+        if self.__names is not None:
+            return self.__names.get(tax_id)
+        if tax_id in self.__found:
+            return self.__found[tax_id]
+        if len(self.__found) >= TAXA_NAMES_SCAN_LIMIT:
+            return self.__parse().get(tax_id)
+
+        # Only object keys are followed by a colon; a quote inside a name is
+        # always escaped, so this cannot match within a name.
+        key = f'"{tax_id}":'
+        pos = self.__text.find(key)
+        names = None
+        if pos >= 0:
+            start = json.decoder.WHITESPACE.match(self.__text, pos + len(key)).end()
+            names, _ = self.__decoder.raw_decode(self.__text, start)
+        self.__found[tax_id] = names
+        return names
+
+    def get(self, tax_id, default=None):
+        names = self.__lookup(tax_id)
+        return default if names is None else names
+
+    def __contains__(self, tax_id):
+        return self.__lookup(tax_id) is not None
+
+    def keys(self):
+        return self.__parse().keys()
+
+    def items(self):
+        return self.__parse().items()
+
+
 class TaxNode:  # pylint: disable=too-few-public-methods
     """An NCBI Taxonomy node linked to its parent and children."""
 
@@ -210,6 +283,45 @@ class Family:  # pylint: disable=too-many-instance-attributes
             self.length or -1,
         )
 
+    __WRAPPERS = {}
+
+    @classmethod
+    def __prefix_lines(cls, prefix, text, wrap=False):
+        """
+        Returns 'text' with 'prefix' at the start of each line, as
+        textwrap.indent does. If 'wrap' is True the text is first filled to
+        72 columns, not counting the prefix.
+        """
+        if wrap:
+            # Most tags fit on one line and have no whitespace for the
+            # wrapper to rewrite; fill() would return them unchanged.
+            if (
+                len(text) <= 72
+                and text.isprintable()
+                and text[:1] != " "
+                and text[-1:] != " "
+            ):
+                return prefix + text
+
+            # The wrapper only indents after its own line breaks, not after
+            # the others that textwrap.indent splits on ("\u2028", "\x85", ...)
+            if not text.isprintable():
+                return textwrap.indent(textwrap.fill(text, width=72), prefix)
+
+            # One wrapper per prefix, with the prefix as its indent
+            wrapper = cls.__WRAPPERS.get(prefix)
+            if wrapper is None:
+                wrapper = cls.__WRAPPERS[prefix] = textwrap.TextWrapper(
+                    width=72 + len(prefix),
+                    initial_indent=prefix,
+                    subsequent_indent=prefix,
+                )
+            return wrapper.fill(text)
+        # Non-printable text may hold line breaks other than "\n"
+        if text.isprintable() and not text.isspace():
+            return prefix + text
+        return textwrap.indent(text, prefix)
+
     def to_dfam_hmm(
         self,
         famdb,
@@ -228,7 +340,7 @@ class Family:  # pylint: disable=too-many-instance-attributes
         if self.model is None:
             return None
 
-        out = ""
+        out = []
 
         # Appends to 'out':
         # "TAG   Text"
@@ -237,25 +349,24 @@ class Family:  # pylint: disable=too-many-instance-attributes
         # "TAG   Line 1"
         # "TAG   Line 2"
         def append(tag, text, wrap=False):
-            nonlocal out
             if not text:
                 return
 
             prefix = "%-6s" % tag
-            text = str(text)
-            if wrap:
-                text = textwrap.fill(text, width=72)
-            out += textwrap.indent(text, prefix)
-            out += "\n"
-
-        # TODO: Compare to e.g. finditer(). This does a lot of unnecessary
-        # allocation since most of model_lines are appended verbatim.
-        model_lines = self.model.split("\n")
-
-        i = 0
-        for i, line in enumerate(model_lines):
+            out.append(self.__prefix_lines(prefix, str(text), wrap))
+            out.append("\n")
+
+        # Only the header, up to and including the CKSUM line, is rewritten.
+        # The rest of the model is appended verbatim.
+        cksum = hmm_cksum_pat.search(self.model)
+        if cksum:
+            header, body = self.model[: cksum.end()], self.model[cksum.end() + 1 :]
+        else:
+            header, body = self.model, ""
+
+        for line in header.split("\n"):
             if line.startswith("HMMER3"):
-                out += line + "\n"
+                out.append(line + "\n")
 
                 name = self.name or self.accession
                 if include_class_in_name:
@@ -267,14 +378,14 @@ class Family:  # pylint: disable=too-many-instance-attributes
                 append("NAME", name)
                 append("ACC", self.accession_with_optional_version())
                 append("DESC", self.title)
-            elif any(map(line.startswith, ["NAME", "ACC", "DESC"])):
+            elif line.startswith(("NAME", "ACC", "DESC")):
                 # Correct version of this line was output already
                 pass
             elif line.startswith("CKSUM"):
-                out += line + "\n"
+                out.append(line + "\n")
                 break
             else:
-                out += line + "\n"
+                out.append(line + "\n")
 
         th_lines = []
         species_hmm_ga = None
@@ -352,9 +463,9 @@ class Family:  # pylint: disable=too-many-instance-attributes
             append("CC", "     Refineable")
 
         # Append all remaining lines unchanged
-        out += "\n".join(model_lines[i + 1 :])
+        out.append(body)
 
-        return out
+        return "".join(out)
 
     __COMPLEMENT_TABLE = str.maketrans("ACGTRYWSKMNXBDHV", "TGCAYRSWMKNXVHDB")
 
@@ -414,14 +525,11 @@ class Family:  # pylint: disable=too-many-instance-attributes
         if self.search_stages:
             header += " [S:%s]" % self.search_stages
 
-        out = header + "\n"
-
-        i = 0
-        while i < len(sequence):
-            out += sequence[i : i + 60] + "\n"
-            i += 60
+        out = [header + "\n"]
+        for i in range(0, len(sequence), 60):
+            out.append(sequence[i : i + 60] + "\n")
 
-        return out
+        return "".join(out)
 
     def to_embl(
         self, famdb, include_meta=True, include_seq=True
@@ -435,7 +543,7 @@ class Family:  # pylint: disable=too-many-instance-attributes
 
         sequence = self.consensus or ""
 
-        out = ""
+        out = []
 
         # Appends to 'out':
         # "TAG  Text"
@@ -444,25 +552,21 @@ class Family:  # pylint: disable=too-many-instance-attributes
         # "TAG  Line 1"
         # "TAG  Line 2"
         def append(tag, text, wrap=False):
-            nonlocal out
             if not text:
                 return
 
             prefix = "%-5s" % tag
-            if wrap:
-                text = textwrap.fill(str(text), width=72)
-            out += textwrap.indent(str(text), prefix)
-            out += "\n"
+            out.append(self.__prefix_lines(prefix, str(text), wrap))
+            out.append("\n")
 
         # Appends to 'out':
         # "FT                   line 1"
         # "FT                   line 2"
         def append_featuredata(text):
-            nonlocal out
             prefix = "FT                   "
             if text:
-                out += textwrap.indent(textwrap.fill(str(text), width=72), prefix)
-                out += "\n"
+                out.append(self.__prefix_lines(prefix, str(text), True))
+                out.append("\n")
 
         id_line = self.accession
         if self.version is not None:
@@ -470,11 +574,11 @@ class Family:  # pylint: disable=too-many-instance-attributes
 
         append("ID", "%s; linear; DNA; STD; UNC; %d BP." % (id_line, len(sequence)))
         append("NM", self.name)
-        out += "XX\n"
+        out.append("XX\n")
         append("AC", self.accession + ";")
-        out += "XX\n"
+        out.append("XX\n")
         append("DE", self.title, True)
-        out += "XX\n"
+        out.append("XX\n")
 
         if include_meta:
             if self.aliases:
@@ -482,7 +586,7 @@ class Family:  # pylint: disable=too-many-instance-attributes
                     [db_id, db_link] = map(str.strip, alias_line.split(":"))
                     if db_id == "Repbase":
                         append("DR", "Repbase; %s." % db_link)
-                        out += "XX\n"
+                        out.append("XX\n")
 
             if self.repeat_type == "LTR":
                 append(
@@ -493,7 +597,7 @@ class Family:  # pylint: disable=too-many-instance-attributes
                 append(
                     "KW", "%s/%s." % (self.repeat_type or "", self.repeat_subtype or "")
                 )
-            out += "XX\n"
+            out.append("XX\n")
 
             for clade_id in self.clades:
                 lineage = famdb.get_lineage_path(clade_id, partition=False)
@@ -502,7 +606,7 @@ class Family:  # pylint: disable=too-many-instance-attributes
                 if len(lineage) > 0:
                     append("OS", lineage[-1])
                     append("OC", "; ".join(lineage[:-1]) + ".", True)
-            out += "XX\n"
+            out.append("XX\n")
 
             if self.citations:
                 citations = json.loads(self.citations)
@@ -514,10 +618,10 @@ class Family:  # pylint: disable=too-many-instance-attributes
                     append("RA", cit["authors"], True)
                     append("RT", cit["title"], True)
                     append("RL", cit["journal"])
-                    out += "XX\n"
+                    out.append("XX\n")
 
             append("CC", self.description, True)
-            out += "CC\n"
+            out.append("CC\n")
             append("CC", "RepeatMasker Annotations:")
             append("CC", "     Type: %s" % (self.repeat_type or ""))
             append("CC", "     SubType: %s" % (self.repeat_subtype or ""))
@@ -531,9 +635,9 @@ class Family:  # pylint: disable=too-many-instance-attributes
                 append("CC", "     Refineable")
 
             if self.coding_sequences:
-                out += "XX\n"
+                out.append("XX\n")
                 append("FH", "Key             Location/Qualifiers")
-                out += "FH\n"
+                out.append("FH\n")
                 for cds in json.loads(self.coding_sequences):
                     # TODO: sanitize values which might already contain a " in them?
 
@@ -546,16 +650,12 @@ class Family:  # pylint: disable=too-many-instance-attributes
                     append_featuredata('/note="%s"' % cds["description"])
                     append_featuredata('/translation="%s"' % cds["translation"])
 
-            out += "XX\n"
+            out.append("XX\n")
 
         if include_seq:
             sequence = sequence.lower()
-            i = 0
-            counts = {"a": 0, "c": 0, "g": 0, "t": 0, "other": 0}
-            for char in sequence:
-                if char not in counts:
-                    char = "other"
-                counts[char] += 1
+            counts = {base: sequence.count(base) for base in "acgt"}
+            counts["other"] = len(sequence) - sum(counts.values())
 
             append(
                 "SQ",
@@ -570,21 +670,15 @@ class Family:  # pylint: disable=too-many-instance-attributes
                 ),
             )
 
-            while i < len(sequence):
+            # 60 bases per line, in groups of 10, followed by the position
+            for i in range(0, len(sequence), 60):
                 chunk = sequence[i : i + 60]
-                i += 60
+                line = " ".join(chunk[j : j + 10] for j in range(0, len(chunk), 10))
+                out.append("     %-66s %d\n" % (line + " ", i + len(chunk)))
 
-                j = 0
-                line = ""
-                while j < len(chunk):
-                    line += chunk[j : j + 10] + " "
-                    j += 10
+        out.append("//\n")
 
-                out += "     %-66s %d\n" % (line, min(i, len(sequence)))
-
-        out += "//\n"
-
-        return out
+        return "".join(out)
 
     @staticmethod
     def read_embl_families(filename, lookup, header_cb=None):
@@ -608,7 +702,7 @@ class Family:  # pylint: disable=too-many-instance-attributes
             For codes corresponding to list attributes, values are appended.
             """
             if code == "ID":
-                match = re.match(r"(\S*)", value)
+                match = embl_id_pat.match(value)
                 acc = match.group(1)
                 acc = acc.rstrip(";")
                 family.accession = acc
@@ -619,15 +713,15 @@ class Family:  # pylint: disable=too-many-instance-attributes
             elif code == "CC":
                 # TODO: Consider only recognizing these after seeing "RepeatMasker Annotations"
 
-                matches = re.match(r"\s*Type:\s*(\S+)", value)
+                matches = embl_type_pat.match(value)
                 if matches:
                     family.repeat_type = matches.group(1).strip()
 
-                matches = re.match(r"\s*SubType:\s*(\S+)", value)
+                matches = embl_subtype_pat.match(value)
                 if matches:
                     family.repeat_subtype = matches.group(1).strip()
 
-                matches = re.search(r"Species:\s*(.+)", value)
+                matches = embl_species_pat.search(value)
                 if matches:
                     for spec in matches.group(1).split(","):
                         name = spec.strip()
@@ -643,24 +737,24 @@ class Family:  # pylint: disable=too-many-instance-attributes
                                     family.clades += [tax_id]
                                 else:
                                     LOGGER.warning("Could not find taxon for '%s' upper or lower: line=%s, and ID=%s", name, value, family.accession)
-                matches = re.search(r"SearchStages:\s*(\S+)", value)
+                matches = embl_search_stages_pat.search(value)
                 if matches:
                     family.search_stages = matches.group(1).strip()
 
-                matches = re.search(r"BufferStages:\s*(\S+)", value)
+                matches = embl_buffer_stages_pat.search(value)
                 if matches:
                     family.buffer_stages = matches.group(1).strip()
 
-                matches = re.search(r"Refineable", value)
-                if matches:
+                if "Refineable" in value:
                     family.refineable = True
 
         header = ""
         family = None
+        sequence_lines = []
         in_header = True
         in_metadata = False
 
-        nodes = lookup.values()
+        nodes = set(lookup.values())
 
         with open(filename) as file:
             for line in file:
@@ -672,21 +766,21 @@ class Family:  # pylint: disable=too-many-instance-attributes
                         in_header = False
                         in_metadata = True
                     elif in_header:
-                        matches = re.match(r"(CC)?\s*(.*)", line)
                         if line.startswith("XX"):
                             in_header = False
-                        elif matches:
-                            header_line = matches.group(2).rstrip("*").strip()
-                            header += header_line + "\n"
                         else:
-                            header += line
+                            # Drop a leading "CC" and trailing "*" decorations
+                            if line.startswith("CC"):
+                                line = line[2:]
+                            header_line = line.lstrip().rstrip("\n").rstrip("*")
+                            header += header_line.strip() + "\n"
 
                 if family is not None:
                     if in_metadata:
                         # SQ line indicates start of sequence
                         if line.startswith("SQ"):
                             in_metadata = False
-                            family.consensus = ""
+                            sequence_lines = []
 
                         # Continuing metadata
                         else:
@@ -698,6 +792,12 @@ class Family:  # pylint: disable=too-many-instance-attributes
 
                     # '//' line indicates end of the sequence area
                     elif line.startswith("//"):
+                        # Drop the spaces, positions and anything else that is not
+                        # a letter, all in one C-level pass over the bytes
+                        sequence = "".join(sequence_lines).encode()
+                        family.consensus = sequence.translate(
+                            None, NON_ALPHA_BYTES
+                        ).decode("ascii")
                         family.length = len(family.consensus)
                         keep = False
                         for clade in family.clades:
@@ -712,7 +812,7 @@ class Family:  # pylint: disable=too-many-instance-attributes
 
                     # Part of the sequence area
                     else:
-                        family.consensus += re.sub(r"[^A-Za-z]", "", line)
+                        sequence_lines.append(line)
 
         # if header_cb:
         #     header_cb(header)
@@ -1,28 +1,26 @@
-import re
 import h5py
 from famdb_globals import (
-    SOUNDEX_LOOKUP,
+    SOUNDEX_TABLE,
     GROUP_FAMILIES,
-    dfam_acc_pat,
+    repeat_pat,
+    sanitize_drop_pat,
+    sanitize_space_pat,
+    soundex_skip_pat,
 )
 from famdb_helper_classes import Family, TaxNode
 
 
 def accession_bin(acc):
     """Maps an accession (Dfam or otherwise) into apropriate bins (groups) in HDF5"""
-    dfam_match = dfam_acc_pat.match(acc)
-    if dfam_match:
-        path = (
-            GROUP_FAMILIES
-            + "/"
-            + dfam_match.group(1)
-            + "/"
-            + dfam_match.group(2)
-            + "/"
-            + dfam_match.group(3)
-            + "/"
-            + dfam_match.group(4)
-        )
+    # Equivalent to dfam_acc_pat, but slicing is cheaper than a regex match
+    prefix, digits = acc[:2], acc[2:]
+    if (
+        prefix in ("DF", "DR")
+        and 9 <= len(digits) <= 12
+        and digits.isascii()
+        and digits.isdigit()
+    ):
+        path = f"{GROUP_FAMILIES}/{prefix}/{digits[0:2]}/{digits[2:4]}/{digits[4:6]}"
     else:
         path = GROUP_FAMILIES + "/Aux/" + acc[0:2].lower()
     return path
@@ -42,30 +40,49 @@ def get_family(entry):
     return family
 
 
-def families_iterator(g, prefix=""):
+def families_iterator(g):
+    """
+    Yields the name of every family dataset below the group 'g', in the same
+    order as walking its groups by name. Links are walked with the low-level
+    API, so no h5py object is created for each group and dataset on the way.
+    """
+
+    def walk(group_id):
+        for name in group_id:
+            if h5py.h5o.get_info(group_id, name).type == h5py.h5o.TYPE_DATASET:
+                yield name.decode()
+            else:
+                yield from walk(h5py.h5g.open(group_id, name))
+
+    yield from walk(g.id)
+
+
+def family_entries_iterator(g):
+    """Like families_iterator, but yields (name, dataset) pairs."""
     for key, item in g.items():
-        path = "{}/{}".format(prefix, key)
-        if isinstance(item, h5py.Dataset):  # test for dataset
-            yield (key)
-        elif isinstance(item, h5py.Group):  # test for group (go down)
-            yield from families_iterator(item, path)
+        if isinstance(item, h5py.Dataset):
+            yield key, item
+        elif isinstance(item, h5py.Group):
+            yield from family_entries_iterator(item)
 
 
 # Filter methods --------------------------------------------------------------------------
-def filter_name(family, name):
+def filter_name(attrs, name):
     """Returns True if the family's name begins with 'name'."""
 
-    if family.attrs.get("name"):
-        if family.attrs["name"].lower().startswith(name):
+    family_name = attrs.get("name")
+    if family_name:
+        if family_name.lower().startswith(name):
             return True
 
     return False
 
 
-def filter_search_stages(family, stages):
+def filter_search_stages(attrs, stages):
     """Returns True if the family belongs to a search stage in 'stages'."""
-    if family.attrs.get("search_stages"):
-        sstages = (ss.strip() for ss in family.attrs["search_stages"].split(","))
+    search_stages = attrs.get("search_stages")
+    if search_stages:
+        sstages = (ss.strip() for ss in search_stages.split(","))
         for family_ss in sstages:
             if family_ss in stages:
                 return True
@@ -73,15 +90,16 @@ def filter_search_stages(family, stages):
     return False
 
 
-def filter_repeat_type(family, rtype):
+def filter_repeat_type(attrs, rtype):
     """
     Returns True if the family's RepeatMasker Type plus SubType
     (e.g. "DNA/CMC-EnSpm") starts with 'rtype'.
     """
-    if family.attrs.get("repeat_type"):
-        full_type = family.attrs["repeat_type"]
-        if family.attrs.get("repeat_subtype"):
-            full_type = full_type + "/" + family.attrs["repeat_subtype"]
+    full_type = attrs.get("repeat_type")
+    if full_type:
+        repeat_subtype = attrs.get("repeat_subtype")
+        if repeat_subtype:
+            full_type = full_type + "/" + repeat_subtype
 
         if full_type.lower().startswith(rtype):
             return True
@@ -119,38 +137,15 @@ def soundex(word):
     [1]: https://en.wikipedia.org/wiki/Soundex#American_Soundex
     """
 
-    codes = [SOUNDEX_LOOKUP[ch] for ch in word.upper() if ch in SOUNDEX_LOOKUP]
-
-    # Start at the second code
-    i = 1
-
-    # Drop identical sounds and H and W
-    while i < len(codes):
-        code = codes[i]
-        prev = codes[i - 1]
-
-        if code is None:
-            # Drop H and W
-            del codes[i]
-        elif code == prev:
-            # Drop adjacent identical sounds
-            del codes[i]
-        else:
-            i += 1
-
-    # Keep the first letter
-    coding = word[0]
-
-    # Keep codes, except for the first or vowels
-    codes_rest = filter(lambda c: c > 0, codes[1:])
+    codes = soundex_skip_pat.sub("", word.upper()).translate(SOUNDEX_TABLE)
 
-    # Append stringified remaining numbers
-    for code in codes_rest:
-        coding += str(code)
+    # Drop H and W, except as the first code, then drop adjacent identical
+    # sounds. H and W do not separate identical sounds, but vowels do.
+    codes = repeat_pat.sub(r"\1", codes[:1] + codes[1:].replace("h", ""))
 
-    # Pad to 3 digits
-    while len(coding) < 4:
-        coding += "0"
+    # Keep the first letter, then the codes except for the first or vowels,
+    # padded to 3 digits
+    coding = word[0] + codes[1:].replace("0", "") + "000"
 
     # Truncate to 3 digits
     return coding[:4]
@@ -174,8 +169,8 @@ def sanitize_name(name):
     Returns the "sanitized" version of the given 'name'.
     This must be kept in sync with Dfam's algorithm.
     """
-    name = re.sub(r"[\s\,\_]+", "_", name)
-    name = re.sub(r"[\(\)\<\>\']+", "", name)
+    name = sanitize_space_pat.sub("_", name)
+    name = sanitize_drop_pat.sub("", name)
     return name
 
 